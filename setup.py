@@ -20,7 +20,7 @@ setup(
     packages=['the_ark', 'the_ark.resources'],
     long_description=readme(),
         install_requires=[
-        "boto3==1.21.23",
+        "boto3==1.25.0",
         "requests==2.25.1",
         "selenium==4.1.3"
     ],
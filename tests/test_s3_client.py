@@ -1,28 +1,33 @@
+import datetime
+import mimetypes
 import unittest
-import urlparse
 import the_ark.s3_client
-from boto.s3.key import Key
-from boto.s3.connection import S3ResponseError
+from botocore.exceptions import ClientError
+from io import BytesIO
 from mock import Mock, patch
-from cStringIO import StringIO
 
 __author__ = 'chaley'
 
 bucket = "some bucket"
 s3_link_url = "http://qa-projects.s3.amazonaws.com/hippo/screenshots/valcyte/test/0EEC852C64F4/screenshot_log.html"
-url_parse_base = urlparse.urlparse(s3_link_url)
 s3_security_link_url = "http://qa-projects.s3.amazonaws.com/hippo/screenshots/valcyte/test/0EEC852C64F4/screenshot_log.html?x-amz-security-token=FQoDYXdzEDYaDDFi4AMLv/N0suzGZSKcA/fEWU1skiy7HOgF/6m8hFwi5Zg5l5nx/Z8HVVtRLvP6c25Ut7QMCIiszRChoIMXfGXHs04aNYU8xvNKXlAxu9MwSqMK0SwDMB3vb4Hb3CIoLX1tDIT/xeBTEqELg/KZxEcOOnnRHBxlg7KajiyCmwpaoRJqkIpRvibrsWIiXrNsvc35zHOn6ZbQs8qFB9JwRTCpqxvtIcaaCPjXUA0K4gwqgwwTq5UC89awj7uijXN2LwmRUQgy6ZvcoNmoxHvMYuoNE%2B6f21WS07I%2BjJFir%2BWNVe3J8YxIXCqGtcmeFn%2BqAz68zTKJVQ2chKrnZf0VoQpUdekr2B6eQojWdoxpMRUNuTm1/5iO3t28w7Lwri900A6Zr9nMh7qqTkFyh5h9RSYv/jvQE0yPcaVwnGmNADfH28uj2j0ucN0sOAvZEdwDVvW8vh6q8ENc6Z/5yu4oOyjWG4rBhxE8ZniOKbMeOwNS3gWYIA1cxJJ8NVSsDP%2BfucOQH//YKC4jFYaGUF9lPmxMlP01c0OFw9n0Ozc6y/sfWfuSaJOj0J8pL20oj6yfwAU%3D"
-url_parse_sec_token = urlparse.urlparse(s3_security_link_url)
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": "error"}}, "HeadObject")
 
 
 class S3InitTestCase(unittest.TestCase):
-    @patch('boto.s3.connection.S3Connection')
+    def tearDown(self):
+        the_ark.s3_client.S3Client.s3_connection = None
+
+    @patch('boto3.client')
     def test_class_init(self, s3con):
         s3con.return_value = {}
         client = the_ark.s3_client.S3Client(bucket)
         self.assertIsNotNone(client)
 
-    @patch('boto.s3.connection.S3Connection')
+    @patch('boto3.client')
     def test_class_init_fail(self, s3con):
         s3con.side_effect = Exception('Boom')
         client = the_ark.s3_client.S3Client(bucket)
@@ -33,26 +38,41 @@ class S3MethodTestCase(unittest.TestCase):
     def setUp(self):
         self.client = the_ark.s3_client.S3Client(bucket)
         self.client.s3_connection = Mock()
-        self.client.bucket = Mock()
 
-    @patch('boto.s3.connection.S3Connection')
+    def tearDown(self):
+        the_ark.s3_client.S3Client.s3_connection = None
+
+    @patch('boto3.client')
     def test_connect(self, s3_cls):
         cls_inst = Mock()
         s3_cls.return_value = cls_inst
 
-        # Set the client connection to None for testing connect
-        self.client.s3_connection = None
-
-        self.client.connect()
+        # Use a fresh client so the connection is created through connect()
+        client = the_ark.s3_client.S3Client(bucket)
+        client.connect()
 
-        s3_cls.assert_called_once_with(is_secure=False)
-        cls_inst.get_bucket.assert_called_once_with('some bucket', validate=False)
+        self.assertEqual(s3_cls.call_count, 1)
+        self.assertEqual(s3_cls.call_args[0], ("s3",))
+        self.assertIs(client.s3_connection, cls_inst)
+        config = s3_cls.call_args[1]["config"]
+        self.assertTrue(config.tcp_keepalive)
+        self.assertEqual(config.max_pool_connections, the_ark.s3_client.MAX_POOL_CONNECTIONS)
 
         # make it go boom
-        self.client.s3_connection = None
+        the_ark.s3_client.S3Client.s3_connection = None
         s3_cls.side_effect = Exception('Boom!')
 
-        self.assertRaises(Exception, self.client.connect)
+        self.assertRaises(the_ark.s3_client.S3ClientException, client.connect)
+
+    @patch('boto3.client')
+    def test_connect_shares_client_between_instances(self, s3_cls):
+        first = the_ark.s3_client.S3Client(bucket)
+        second = the_ark.s3_client.S3Client("another bucket")
+        first.connect()
+        second.connect()
+
+        s3_cls.assert_called_once()
+        self.assertIs(first.s3_connection, second.s3_connection)
 
     def test_generate_path(self):
         self.assertEqual('s3_path/file_to_store',
@@ -71,132 +91,164 @@ class S3MethodTestCase(unittest.TestCase):
                          self.client._generate_file_path(
                              "/qa/tools/marketing", "file_to_store/"))
 
+    def test_guess_mime_type(self):
+        self.assertEqual(the_ark.s3_client._guess_mime_type("screenshot.png"), "image/png")
+        self.assertEqual(the_ark.s3_client._guess_mime_type("other screenshot.png"), "image/png")
+        self.assertEqual(the_ark.s3_client._guess_mime_type("log.html"), "text/html")
+        self.assertEqual(the_ark.s3_client._guess_mime_type("LOG.HTML"), "text/html")
+        self.assertEqual(the_ark.s3_client._guess_mime_type("logs.tar.gz"), "application/x-tar")
+        self.assertIsNone(the_ark.s3_client._guess_mime_type("no extension"))
+        self.assertIsNone(the_ark.s3_client._guess_mime_type("folder.v2/no extension"))
+
+    @patch('mimetypes.guess_type', wraps=mimetypes.guess_type)
+    def test_guess_mime_type_is_cached_per_extension(self, guess_type):
+        the_ark.s3_client._guess_extension_mime_type.cache_clear()
+        for index in range(200):
+            self.assertEqual(the_ark.s3_client._guess_mime_type(f"screenshot_{index}.png"), "image/png")
+
+        guess_type.assert_called_once()
+        cache_info = the_ark.s3_client._guess_extension_mime_type.cache_info()
+        self.assertEqual(cache_info.hits, 199)
+        self.assertLessEqual(cache_info.currsize, the_ark.s3_client.MIME_TYPE_CACHE_SIZE)
+
     def test_verify_file(self):
-        self.client.bucket.get_key.return_value = None
+        self.client.s3_connection.head_object.side_effect = client_error("404")
         self.assertFalse(self.client.verify_file("s3_path", "file_to_store"))
 
-        self.client.bucket.get_key.return_value = "testing"
+        self.client.s3_connection.head_object.side_effect = None
+        self.client.s3_connection.head_object.return_value = {"ContentLength": 1}
         self.assertTrue(self.client.verify_file("s3_path", "file_to_store"))
+        self.client.s3_connection.head_object.assert_called_with(Bucket=bucket, Key="s3_path/file_to_store")
+
+    def test_verify_file_client_error(self):
+        self.client.s3_connection.head_object.side_effect = client_error("403")
+        with self.assertRaises(the_ark.s3_client.S3ClientException):
+            self.client.verify_file('stuff', 'more stuff')
 
     def test_verify_file_boom(self):
-        self.client.bucket.get_key.side_effect = Exception(
+        self.client.s3_connection.head_object.side_effect = Exception(
             'Here Comes the Boom!')
         with self.assertRaises(the_ark.s3_client.S3ClientException):
             self.client.verify_file('stuff', 'more stuff')
 
     @patch('the_ark.s3_client.S3Client.verify_file')
     def test_get_file(self, verify):
-        mock_file = Mock()
         verify.return_value = True
-        self.client.bucket.get_key.return_value = mock_file
-        self.client.get_file('stuff', 'more stuff')
+        retrieved_file = self.client.get_file('stuff', 'more stuff')
 
-        self.client.bucket.get_key.assert_called_once_with(
-            'stuff/more stuff')
+        self.assertIsInstance(retrieved_file, BytesIO)
+        self.assertEqual(self.client.s3_connection.download_fileobj.call_args[0][:2],
+                         (bucket, 'stuff/more stuff'))
 
     @patch('the_ark.s3_client.S3Client.verify_file')
     def test_get_file_with_no_file(self, verify):
-        mock_file = Mock()
         verify.return_value = False
-        self.client.bucket.get_key.return_value = mock_file
         with self.assertRaises(the_ark.s3_client.S3ClientException):
             self.client.get_file('stuff', 'more stuff')
 
     def test_get_file_boom(self):
-        self.client.bucket.get_key.side_effect = Exception(
+        self.client.s3_connection.head_object.side_effect = Exception(
             'Here Comes the Boom!')
         with self.assertRaises(the_ark.s3_client.S3ClientException):
             self.client.get_file('stuff', 'more stuff')
 
     def test_store_file_s3_client_error(self):
+        self.client.s3_connection.upload_file.side_effect = Exception('Boom!')
         with self.assertRaises(the_ark.s3_client.S3ClientException):
             self.client.store_file(s3_path='path', file_to_store='file', filename="bob's file")
 
-    @patch('the_ark.s3_client.S3Client._split_file')
-    @patch('shutil.rmtree')
-    @patch('urlparse.urlparse')
-    @patch('mimetypes.guess_type')
-    @patch('boto.s3.key.Key.set_contents_from_file')
-    @patch('os.path.getsize')
-    @patch('os.listdir')
-    def test_store_file_multipart_s3_error(self, listdir, get_size, set_contents, guess_type, url_parse, rmtree, split_file):
-        url_parse.return_value = url_parse_base.scheme, url_parse_base.netloc, url_parse_base.path, \
-                                 url_parse_base.params, url_parse_base.query, url_parse_base.fragment
-        guess_type.return_value("image/png")
-        mock_multipart_upload = Mock()
-        mock_file = Mock(spec_set=str)
-        temp_dir = Mock()
-        split_file.return_value = temp_dir
-        listdir.return_value = []
-        self.client.bucket.initiate_multipart_upload.return_value = mock_multipart_upload
-        mock_multipart_upload.complete_upload.side_effect = S3ResponseError("error", "S3 multipart exception")
-        get_size.return_value = the_ark.s3_client.DEFAULT_MINIMUM_SPLIT_AT_SIZE + 1000
-        set_contents.return_value(True)
-        self.client.store_file(s3_path='path', file_to_store=mock_file, filename="bob's file")
-        mock_multipart_upload.cancel_upload.assert_called_once_with()
-        rmtree.assert_called_once_with(temp_dir)
-
-    @patch('the_ark.s3_client.S3Client._split_file')
-    @patch('urlparse.urlparse')
-    @patch('mimetypes.guess_type')
-    @patch('boto.s3.key.Key.set_contents_from_file')
-    @patch('os.path.getsize')
-    def test_store_file_multipart_unexpected_error(self, get_size, set_contents, guess_type, url_parse, split_file):
-        url_parse.return_value = url_parse_base.scheme, url_parse_base.netloc, url_parse_base.path, \
-                                 url_parse_base.params, url_parse_base.query, url_parse_base.fragment
-        guess_type.return_value("image/png")
-        mock_multipart_upload = Mock()
-        mock_file = Mock(spec_set=str)
-        split_file.side_effect = the_ark.s3_client.S3ClientException("Unexpected split exception")
-        self.client.bucket.initiate_multipart_upload.return_value = mock_multipart_upload
-        get_size.return_value = the_ark.s3_client.DEFAULT_MINIMUM_SPLIT_AT_SIZE + 1000
-        set_contents.return_value(True)
-        self.client.store_file(s3_path='path', file_to_store=mock_file, filename="bob's file")
-        mock_multipart_upload.cancel_upload.assert_called_once_with()
-
-    @patch('urlparse.urlparse')
-    @patch('mimetypes.guess_type')
-    @patch('boto.s3.key.Key.set_contents_from_file')
-    def test_store_file(self, set_contents, guess_type, url_parse):
-        url_parse.return_value = url_parse_base.scheme, url_parse_base.netloc, url_parse_base.path, \
-                                 url_parse_base.params, url_parse_base.query, url_parse_base.fragment
-        guess_type.return_value("image/png")
-        set_contents.return_value(True)
-        self.client.store_file(
-            'stuff', "./tests/etc/all_black.png", return_url=True, filename="this file")
+    def test_store_file(self):
+        self.client.s3_connection.generate_presigned_url.return_value = s3_link_url
+        returned_url = self.client.store_file(
+            'stuff', "./tests/etc/all_black.png", return_url=True, filename="this file.png")
+        self.assertEqual(returned_url, s3_link_url)
+        self.client.s3_connection.upload_file.assert_called_with(
+            "./tests/etc/all_black.png", bucket, "stuff/this file.png", ExtraArgs={"ContentType": "image/png"},
+            Config=the_ark.s3_client.TRANSFER_CONFIG)
 
-        self.client.store_file(
-            'stuff', "./tests/etc/all_black.png", return_url=False, filename="this file")
-
-    @patch('urlparse.urlparse')
-    @patch('mimetypes.guess_type')
-    @patch('boto.s3.key.Key.set_contents_from_file')
-    def test_store_file_with_security_token(self, set_contents, guess_type, url_parse):
-        url_parse.return_value = url_parse_sec_token.scheme, url_parse_sec_token.netloc, url_parse_sec_token.path, \
-                                 url_parse_sec_token.params, url_parse_sec_token.query, url_parse_sec_token.fragment
-        guess_type.return_value("image/png")
-        set_contents.return_value(True)
-        returned_url = self.client.store_file('stuff', 1, return_url=True, filename="this file")
+        self.assertIsNone(self.client.store_file(
+            'stuff', "./tests/etc/all_black.png", return_url=False, filename="this file"))
+
+    def test_store_file_with_security_token(self):
+        self.client.s3_connection.generate_presigned_url.return_value = s3_security_link_url
+        returned_url = self.client.store_file('stuff', BytesIO(), return_url=True, filename="this file")
         self.assertEqual(returned_url, s3_link_url)
 
-    @patch('boto.s3.bucket.Bucket.list')
-    def test_get_all_filenames_in_folder(self, mock_list):
-        mock_list.return_value = []
-        self.client.get_all_filenames_in_folder('path')
+    def test_store_file_with_bytesIO(self):
+        image_file = BytesIO()
+        with open("./tests/etc/test.png", "rb") as f:
+            image_file.write(f.read())
+        image_file.seek(0)
+        self.client.store_file(
+            'stuff', image_file, return_url=False, filename="this file", mime_type="image/png")
+
+        self.client.s3_connection.upload_fileobj.assert_called_with(
+            image_file, bucket, "stuff/this file", ExtraArgs={"ContentType": "image/png"},
+            Config=the_ark.s3_client.TRANSFER_CONFIG)
+
+    def test_verify_file_uses_prefetched_listing(self):
+        paginator = Mock()
+        paginator.paginate.return_value = [{"Contents": [{"Key": "s3_path/file_to_store"}]}]
+        self.client.s3_connection.get_paginator.return_value = paginator
+        self.client.prefetch_folder("s3_path")
+
+        self.assertTrue(self.client.verify_file("s3_path", "file_to_store"))
+        self.client.s3_connection.head_object.assert_not_called()
+
+    def test_prefetch_folder_drops_deleted_files(self):
+        paginator = Mock()
+        paginator.paginate.return_value = [{"Contents": [{"Key": "s3_path/file_to_store"}]}]
+        self.client.s3_connection.get_paginator.return_value = paginator
+        self.client.prefetch_folder("s3_path")
+
+        paginator.paginate.return_value = [{}]
+        self.client.prefetch_folder("s3_path")
+        self.client.s3_connection.head_object.side_effect = client_error("404")
+        self.assertFalse(self.client.verify_file("s3_path", "file_to_store"))
+
+    def test_clear_listing_cache(self):
+        paginator = Mock()
+        paginator.paginate.return_value = [{"Contents": [{"Key": "s3_path/file_to_store"}]}]
+        self.client.s3_connection.get_paginator.return_value = paginator
+        self.client.prefetch_folder("s3_path")
+
+        self.client.clear_listing_cache()
+        self.client.s3_connection.head_object.side_effect = client_error("404")
+        self.assertFalse(self.client.verify_file("s3_path", "file_to_store"))
+
+    def test_get_file_deleted_after_prefetch(self):
+        paginator = Mock()
+        paginator.paginate.return_value = [{"Contents": [{"Key": "s3_path/file_to_store"}]}]
+        self.client.s3_connection.get_paginator.return_value = paginator
+        self.client.prefetch_folder("s3_path")
+
+        self.client.s3_connection.download_fileobj.side_effect = client_error("404")
+        with self.assertRaises(the_ark.s3_client.S3ClientException) as s3_error:
+            self.client.get_file("s3_path", "file_to_store")
+        self.assertIn("File not found in S3", str(s3_error.exception))
+
+        self.client.s3_connection.head_object.side_effect = client_error("404")
+        self.assertFalse(self.client.verify_file("s3_path", "file_to_store"))
+
+    def test_get_all_filenames_in_folder(self):
+        paginator = Mock()
+        paginator.paginate.return_value = [{"Contents": [{"Key": "path/one"}]}, {}]
+        self.client.s3_connection.get_paginator.return_value = paginator
+        self.assertEqual(self.client.get_all_filenames_in_folder('path'), [{"Key": "path/one"}])
 
     def test_get_most_recent_file_from_s3_key_list(self):
-        first = Key()
-        second = Key()
-        third = Key()
-        first.last_modified = 3
-        second.last_modified = 4
-        third.last_modified = 1
+        first = {"Key": "first", "LastModified": datetime.datetime(2020, 1, 3)}
+        second = {"Key": "second", "LastModified": datetime.datetime(2020, 1, 4)}
+        third = {"Key": "third", "LastModified": datetime.datetime(2020, 1, 1)}
         key_list = [first, second, third]
 
         most_recent_key = self.client. \
             get_most_recent_file_from_s3_key_list(key_list)
         self.assertEqual(
-            most_recent_key.last_modified, key_list[1].last_modified)
+            most_recent_key["LastModified"], key_list[1]["LastModified"])
+
+    def test_get_most_recent_file_from_empty_s3_key_list(self):
+        self.assertIsNone(self.client.get_most_recent_file_from_s3_key_list([]))
 
     @patch('tempfile.mkdtemp')
     @patch('os.path.getsize')
@@ -222,40 +274,6 @@ class S3MethodTestCase(unittest.TestCase):
         with self.assertRaises(the_ark.s3_client.S3ClientException):
             self.client._split_file("test")
 
-    @patch('urlparse.urlparse')
-    @patch('mimetypes.guess_type')
-    @patch('boto.s3.key.Key.set_contents_from_file')
-    @patch('os.path.getsize')
-    def test_store_file_with_split(self, get_size, set_contents, guess_type, url_parse):
-        url_parse.return_value = url_parse_sec_token.scheme, url_parse_sec_token.netloc, url_parse_sec_token.path, \
-                                 url_parse_sec_token.params, url_parse_sec_token.query, url_parse_sec_token.fragment
-        guess_type.return_value("image/png")
-        set_contents.return_value(True)
-        get_size.return_value = the_ark.s3_client.DEFAULT_MINIMUM_SPLIT_AT_SIZE + 100
-        self.client.store_file(
-            'stuff', "./tests/etc/test.png", return_url=True, filename="this file")
-
-        self.client.store_file(
-            'stuff', "./tests/etc/test.png", return_url=False, filename="this file")
-
-    @patch('urlparse.urlparse')
-    @patch('mimetypes.guess_type')
-    @patch('boto.s3.key.Key.set_contents_from_file')
-    def test_store_file_with_stringIO(self, set_contents, guess_type, url_parse):
-        url_parse.return_value = url_parse_sec_token.scheme, url_parse_sec_token.netloc, url_parse_sec_token.path, \
-                                 url_parse_sec_token.params, url_parse_sec_token.query, url_parse_sec_token.fragment
-        guess_type.return_value("image/png")
-        set_contents.return_value(True)
-        image_file = StringIO()
-        with open("./tests/etc/test.png") as f:
-            image_file.write(f.read())
-        image_file.seek(0)
-        self.client.store_file(
-            'stuff', image_file, return_url=True, filename="this file")
-
-        self.client.store_file(
-            'stuff', image_file, return_url=False, filename="this file")
-
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,11 @@
-from mock import patch
+from mock import Mock, patch
+import numpy
 import os
 from PIL import Image
 from the_ark import selenium_helpers
-from the_ark.screen_capture import Screenshot, ScreenshotException, SeleniumError, DEFAULT_PIXEL_MATCH_OFFSET
-from StringIO import StringIO
+from the_ark.screen_capture import Screenshot, ScreenshotException, SeleniumError, DEFAULT_PIXEL_MATCH_OFFSET, \
+    _find_crop_row
+from io import BytesIO
 import unittest
 
 ROOT = os.path.abspath(os.path.dirname(__file__))
@@ -43,7 +45,7 @@ class ScreenCaptureTestCase(unittest.TestCase):
     def test_capture_single_viewport(self, image_data):
         image_data.return_value = Image.open(SCREENSHOT_TEST_PNG)
         returned_image = self.sc.capture_page(True)
-        self.assertIsInstance(returned_image, StringIO)
+        self.assertIsInstance(returned_image, BytesIO)
 
     # - Paginated
     @patch("the_ark.screen_capture.Screenshot._capture_single_viewport")
@@ -63,6 +65,60 @@ class ScreenCaptureTestCase(unittest.TestCase):
         self.sc.capture_page(False, 300)
         capture_paginated_page.assert_called_with(300)
 
+    @patch("the_ark.screen_capture.Screenshot._capture_single_viewport")
+    def test_paginated_capture_to_s3(self, capture_single_viewport):
+        capture_single_viewport.return_value = BytesIO()
+        s3_client = Mock()
+        filenames = self.sc.capture_paginated_page_to_s3(s3_client, "path")
+        self.assertEqual(filenames, ["page_0.png", "page_1.png", "page_2.png", "page_3.png"])
+        self.assertEqual(s3_client.store_file.call_count, 4)
+
+    @patch("the_ark.screen_capture.Screenshot._capture_single_viewport")
+    def test_paginated_capture_to_s3_upload_error(self, capture_single_viewport):
+        capture_single_viewport.return_value = BytesIO()
+        s3_client = Mock()
+        s3_client.store_file.side_effect = Exception("Boo!")
+        with self.assertRaises(ScreenshotException):
+            self.sc.capture_paginated_page_to_s3(s3_client, "path")
+
+    @patch("the_ark.screen_capture.Screenshot._capture_paginated_page")
+    @patch("the_ark.screen_capture.Screenshot._capture_headless_paginated_page")
+    def test_paginated_capture_to_s3_headless(self, headless_paginated_page, paginated_page):
+        def capture_viewports(padding=None, on_capture=None):
+            for index in range(2):
+                on_capture(index, BytesIO())
+
+        headless_paginated_page.side_effect = capture_viewports
+        self.sc.headless = True
+        s3_client = Mock()
+        filenames = self.sc.capture_paginated_page_to_s3(s3_client, "path")
+        self.assertEqual(filenames, ["page_0.png", "page_1.png"])
+        self.assertEqual(s3_client.store_file.call_count, 2)
+        paginated_page.assert_not_called()
+
+    # - Stored on S3
+    @patch("the_ark.screen_capture.Screenshot._get_image_data")
+    def test_capture_page_to_s3_streams_image(self, image_data):
+        image_data.return_value = Image.open(SCREENSHOT_TEST_PNG)
+        uploaded = {}
+
+        def store_file(s3_path, file_to_store, filename, return_url=False):
+            uploaded["data"] = file_to_store.read()
+            return "url"
+
+        s3_client = Mock()
+        s3_client.store_file.side_effect = store_file
+        self.assertEqual(self.sc.capture_page_to_s3(s3_client, "path", "page.png", return_url=True), "url")
+        self.assertEqual(Image.open(BytesIO(uploaded["data"])).size, Image.open(SCREENSHOT_TEST_PNG).size)
+
+    @patch("the_ark.screen_capture.Screenshot._get_image_data")
+    def test_capture_page_to_s3_upload_error(self, image_data):
+        image_data.return_value = Image.open(SCREENSHOT_TEST_PNG)
+        s3_client = Mock()
+        s3_client.store_file.side_effect = Exception("Boo!")
+        with self.assertRaises(ScreenshotException):
+            self.sc.capture_page_to_s3(s3_client, "path", "page.png")
+
     # - Full Page
     @patch("the_ark.screen_capture.Screenshot._crop_and_stitch_image")
     @patch("the_ark.screen_capture.Screenshot._get_image_data")
@@ -76,27 +132,27 @@ class ScreenCaptureTestCase(unittest.TestCase):
         self.sc.footers = ["footers"]
         self.sc.headers = ["headers"]
         returned_image = self.sc.capture_page()
-        self.assertIsInstance(returned_image, StringIO)
+        self.assertIsInstance(returned_image, BytesIO)
 
     @patch("the_ark.screen_capture.Screenshot._get_image_data")
     def test_capture_full_page_with_headers_only(self, image_data):
         image_data.return_value = Image.open(SCREENSHOT_TEST_PNG)
         self.sc.headers = ["headers"]
         returned_image = self.sc.capture_page()
-        self.assertIsInstance(returned_image, StringIO)
+        self.assertIsInstance(returned_image, BytesIO)
 
     @patch("the_ark.screen_capture.Screenshot._get_image_data")
     def test_capture_full_page_with_footers_only(self, image_data):
         image_data.return_value = Image.open(SCREENSHOT_TEST_PNG)
         self.sc.footers = ["footers"]
         returned_image = self.sc.capture_page()
-        self.assertIsInstance(returned_image, StringIO)
+        self.assertIsInstance(returned_image, BytesIO)
 
     @patch("the_ark.screen_capture.Screenshot._get_image_data")
     def test_capture_full_page_with_no_stickies(self, image_data):
         image_data.return_value = Image.open(SCREENSHOT_TEST_PNG)
         returned_image = self.sc.capture_page()
-        self.assertIsInstance(returned_image, StringIO)
+        self.assertIsInstance(returned_image, BytesIO)
 
     # - Scrolling Element
     def test_scrolling_element_with_viewport_only(self):
@@ -155,16 +211,29 @@ class ScreenCaptureTestCase(unittest.TestCase):
         link = "li.hidden"
         sc._hide_elements([link])
 
-    @patch("the_ark.selenium_helpers.SeleniumHelpers.hide_element")
-    def test_hide_elements_general_error(self, hide_element):
+    def test_hide_elements_missing_element(self):
         sc = Screenshot(self.sh)
         self.sh.create_driver(browserName="phantomjs")
         self.sh.load_url(SELENIUM_TEST_HTML, bypass_status_code_check=True)
 
-        hide_element.side_effect = selenium_helpers.ElementError("Boo!", "stacktrace", "google", ".class")
-
         sc._hide_elements(["li.badClass"])
 
+    def test_hide_elements_invalid_selector(self):
+        sc = Screenshot(self.sh)
+        self.sh.create_driver(browserName="phantomjs")
+        self.sh.load_url(SELENIUM_TEST_HTML, bypass_status_code_check=True)
+
+        link = "li.valid"
+        sc._hide_elements(["li[bad", link])
+        with self.assertRaises(selenium_helpers.ElementNotVisibleError):
+            self.sh.click_an_element(link)
+
+    @patch("the_ark.selenium_helpers.SeleniumHelpers.execute_script")
+    def test_hide_elements_single_script_call(self, execute_script):
+        self.sc._hide_elements(["header", ".nav", "#banner"])
+        execute_script.assert_called_once()
+        self.assertEqual(execute_script.call_args[0][1:], (["header", ".nav", "#banner"], "none"))
+
     # - Show Elements
     def test_show_elements(self):
         sc = Screenshot(self.sh)
@@ -175,14 +244,11 @@ class ScreenCaptureTestCase(unittest.TestCase):
         sc._show_elements([link])
         self.sh.click_an_element(link)
 
-    @patch("the_ark.selenium_helpers.SeleniumHelpers.show_element")
-    def test_show_elements_error(self, show_element):
+    def test_show_elements_missing_element(self):
         sc = Screenshot(self.sh)
         self.sh.create_driver(browserName="phantomjs")
         self.sh.load_url(SELENIUM_TEST_HTML, bypass_status_code_check=True)
 
-        show_element.side_effect = selenium_helpers.ElementError("Boo!", "stacktrace", "google", ".class")
-
         sc._show_elements(["li.badClass"])
 
     # - Crop and Stitch
@@ -232,6 +298,20 @@ class ScreenCaptureTestCase(unittest.TestCase):
         returned_image = self.sc._crop_and_stitch_image(header, footer)
         self.assertIsInstance(returned_image, Image.Image)
 
+    # - Create Image File
+    def test_create_image_file_compress_level(self):
+        image = Image.open(SCREENSHOT_TEST_PNG)
+        fast_file = Screenshot(self.sh, compress_level=1)._create_image_file(image)
+        small_file = Screenshot(self.sh, compress_level=9)._create_image_file(image)
+        self.assertIsInstance(fast_file, BytesIO)
+        self.assertEqual(Image.open(fast_file).tobytes(), Image.open(small_file).tobytes())
+
+    def test_create_image_file_returns_independent_files(self):
+        large_file = self.sc._create_image_file(Image.open(SCREENSHOT_TEST_PNG))
+        small_file = self.sc._create_image_file(Image.open(SMALL_TEST_PNG))
+        self.assertEqual(Image.open(large_file).size, Image.open(SCREENSHOT_TEST_PNG).size)
+        self.assertEqual(Image.open(small_file).size, Image.open(SMALL_TEST_PNG).size)
+
     # ===================================================================
     # --- Exceptions
     # ===================================================================
@@ -290,3 +370,145 @@ class ScreenCaptureTestCase(unittest.TestCase):
             self.sc.capture_horizontal_scrolling_element(css_selector)
         self.assertIn("Unhandled", selenium_error.exception.msg)
         self.assertIn(css_selector, selenium_error.exception.msg)
+
+
+class PaginatedCaptureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sh = Mock()
+        self.sh.desired_capabilities = {"browserName": "chrome"}
+        with open(SCREENSHOT_TEST_PNG, "rb") as png_file:
+            self.sh.get_screenshot_png.return_value = png_file.read()
+        self.sh.get_viewport_size.return_value = (300, 100)
+        # Two scrolls move the page, the third finds it already at the bottom
+        self.sh.get_window_current_scroll_position.side_effect = [50, 100, 100]
+
+    def test_capture_paginated_page_looks_up_viewport_once(self):
+        image_list = Screenshot(self.sh)._capture_paginated_page(padding=50)
+        self.assertEqual(len(image_list), 3)
+        self.assertEqual(self.sh.get_screenshot_png.call_count, 3)
+        self.sh.get_viewport_size.assert_called_once()
+        # The scroll position is only read after each scroll, never again while cropping each viewport
+        self.assertEqual(self.sh.get_window_current_scroll_position.call_count, 3)
+
+
+class StreamImageToS3TestCase(unittest.TestCase):
+    def setUp(self):
+        sh = Mock()
+        sh.desired_capabilities = {"browserName": "chrome"}
+        self.sc = Screenshot(sh)
+
+    @patch("the_ark.screen_capture.Screenshot._get_image_data")
+    def test_capture_page_to_s3_encode_error_aborts_upload(self, image_data):
+        def save(image_file, *args, **kwargs):
+            image_file.write(b"\0" * 12000)
+            raise OSError("Boo!")
+
+        image_data.return_value = Mock()
+        image_data.return_value.save.side_effect = save
+        upload = {"data": b"", "completed": False}
+
+        def store_file(s3_path, file_to_store, filename, return_url=False):
+            while True:
+                chunk = file_to_store.read(4096)
+                if not chunk:
+                    break
+                upload["data"] += chunk
+            upload["completed"] = True
+
+        s3_client = Mock()
+        s3_client.store_file.side_effect = store_file
+        with self.assertRaises(ScreenshotException):
+            self.sc.capture_page_to_s3(s3_client, "path", "page.png", viewport_only=True)
+        self.assertEqual(len(upload["data"]), 12000)
+        self.assertFalse(upload["completed"])
+
+    def test_capture_page_to_s3_rejects_paginated(self):
+        self.sc.paginated = True
+        for headless in (False, True):
+            self.sc.headless = headless
+            s3_client = Mock()
+            with self.assertRaises(ScreenshotException) as screenshot_error:
+                self.sc.capture_page_to_s3(s3_client, "path", "page.png")
+            self.assertIn("capture_paginated_page_to_s3", screenshot_error.exception.msg)
+            s3_client.store_file.assert_not_called()
+
+
+class ScrollingElementDevToolsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sh = Mock()
+        self.sh.desired_capabilities = {"browserName": "chrome"}
+        self.sh.get_is_element_scroll_position_at_bottom.side_effect = [False, True]
+        with open(SCREENSHOT_TEST_PNG, "rb") as png_file:
+            self.png_bytes = png_file.read()
+        self.sh.get_screenshot_png_cdp.return_value = self.png_bytes
+
+    @patch("the_ark.screen_capture.Screenshot._capture_single_viewport")
+    def test_scrolling_element_uses_devtools(self, capture_single_viewport):
+        sc = Screenshot(self.sh)
+        image_list = sc.capture_scrolling_element(".scrollable")
+        self.assertEqual([image_file.getvalue() for image_file in image_list], [self.png_bytes, self.png_bytes])
+        self.assertEqual(self.sh.get_screenshot_png_cdp.call_count, 2)
+        capture_single_viewport.assert_not_called()
+
+    @patch("the_ark.screen_capture.Screenshot._capture_full_page")
+    def test_scrolling_element_full_page_skips_devtools(self, capture_full_page):
+        sc = Screenshot(self.sh)
+        sc.capture_scrolling_element(".scrollable", viewport_only=False)
+        self.assertEqual(capture_full_page.call_count, 2)
+        self.sh.get_screenshot_png_cdp.assert_not_called()
+
+    @patch("the_ark.screen_capture.Screenshot._capture_headless_page")
+    def test_scrolling_element_headless_skips_devtools(self, capture_headless_page):
+        sc = Screenshot(self.sh)
+        sc.headless = True
+        sc.capture_scrolling_element(".scrollable")
+        self.assertEqual(capture_headless_page.call_count, 2)
+        self.sh.get_screenshot_png_cdp.assert_not_called()
+
+    @patch("the_ark.screen_capture.Screenshot._capture_single_viewport")
+    def test_scrolling_element_without_devtools(self, capture_single_viewport):
+        self.sh.driver = Mock(spec=["execute_script"])
+        sc = Screenshot(self.sh)
+        sc.capture_scrolling_element(".scrollable")
+        self.assertEqual(capture_single_viewport.call_count, 2)
+        self.sh.get_screenshot_png_cdp.assert_not_called()
+
+
+class FindCropRowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.footer = numpy.arange(60 * 4 * 3, dtype=numpy.uint8).reshape(60, 4, 3)
+
+    def test_find_crop_row(self):
+        self.assertEqual(_find_crop_row(self.footer, self.footer[20:30]), 30)
+
+    def test_find_crop_row_match_at_top_of_footer(self):
+        self.assertEqual(_find_crop_row(self.footer, self.footer[:10]), 10)
+
+    def test_find_crop_row_requires_every_row_to_match(self):
+        header_rows = self.footer[20:30].copy()
+        header_rows[-1] = 0
+        self.assertEqual(_find_crop_row(self.footer, header_rows), 0)
+
+    @patch("the_ark.screen_capture.numpy.array_equal", wraps=numpy.array_equal)
+    def test_find_crop_row_uniform_footer(self, array_equal):
+        # A plain white footer matches the first header row at every start row, which is the worst case for the search
+        footer = numpy.full((800, 40, 3), 255, dtype=numpy.uint8)
+        header_rows = footer[:100].copy()
+        header_rows[-1, 0] = 0
+        self.assertEqual(_find_crop_row(footer, header_rows), 0)
+        # Only the check at the top of the footer compares a full block, no start row needs to be verified
+        self.assertLessEqual(array_equal.call_count, 1)
+
+    def test_find_crop_row_rgba(self):
+        footer = numpy.random.RandomState(0).randint(0, 256, (60, 4, 4)).astype(numpy.uint8)
+        self.assertEqual(_find_crop_row(footer, footer[20:30]), 30)
+
+    def test_find_crop_row_rgba_requires_every_channel_to_match(self):
+        footer = numpy.random.RandomState(0).randint(0, 256, (60, 4, 4)).astype(numpy.uint8)
+        header_rows = footer[20:30].copy()
+        header_rows[5, 2, 3] += 1
+        self.assertEqual(_find_crop_row(footer, header_rows), 0)
+
+    def test_find_crop_row_mismatched_modes(self):
+        rgba_rows = numpy.zeros((10, 4, 4), dtype=numpy.uint8)
+        self.assertEqual(_find_crop_row(self.footer, rgba_rows), 0)
@@ -256,6 +256,27 @@ class SeleniumHelpersTestCase(unittest.TestCase):
         sh = selenium_helpers.SeleniumHelpers()
         self.assertRaises(selenium_helpers.DriverAttributeError, sh.get_screenshot_base64)
 
+    @patch("selenium.webdriver.remote.webdriver.WebDriver.get_screenshot_as_png")
+    def test_get_screenshot_png_valid(self, mock_png):
+        self.sh.get_screenshot_png()
+        self.assertTrue(mock_png.called)
+
+    def test_get_screenshot_png_invalid(self):
+        sh = selenium_helpers.SeleniumHelpers()
+        self.assertRaises(selenium_helpers.DriverAttributeError, sh.get_screenshot_png)
+
+    def test_get_screenshot_png_cdp_valid(self):
+        sh = selenium_helpers.SeleniumHelpers()
+        sh.driver = Mock()
+        sh.driver.execute_cdp_cmd.return_value = {"data": "iVBORw0KGgo="}
+        self.assertEqual(sh.get_screenshot_png_cdp(), b"\x89PNG\r\n\x1a\n")
+        sh.driver.execute_cdp_cmd.assert_called_once_with("Page.captureScreenshot",
+                                                          {"format": "png", "captureBeyondViewport": False})
+
+    def test_get_screenshot_png_cdp_invalid(self):
+        sh = selenium_helpers.SeleniumHelpers()
+        self.assertRaises(selenium_helpers.DriverAttributeError, sh.get_screenshot_png_cdp)
+
     @patch("selenium.webdriver.remote.webdriver.WebDriver.get_screenshot_as_file")
     def test_save_screenshot_as_file_valid(self, mock_save_screenshot):
         self.sh.save_screenshot_as_file(file_path='{0}/etc/'.format(ROOT), file_name="save_screenshot_test.png")
@@ -605,6 +626,15 @@ class SeleniumHelpersTestCase(unittest.TestCase):
         mock_scroll_both.assert_any_call("return window.scrollX;")
         mock_scroll_both.assert_any_call("return window.scrollY;")
 
+    @patch("selenium.webdriver.remote.webdriver.WebDriver.execute_async_script")
+    def test_wait_for_scroll_settled_valid(self, mock_execute_async_script):
+        self.sh.wait_for_scroll_settled()
+        self.assertTrue(mock_execute_async_script.called)
+
+    def test_wait_for_scroll_settled_invalid(self):
+        sh = selenium_helpers.SeleniumHelpers()
+        self.assertRaises(selenium_helpers.DriverAttributeError, sh.wait_for_scroll_settled)
+
     def test_get_window_current_scroll_position_both_values_valid(self):
         x_position, y_position = self.sh.get_window_current_scroll_position(get_both_positions=True)
         self.assertEqual(x_position, 0)
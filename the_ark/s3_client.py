@@ -4,6 +4,10 @@ import os
 import shutil
 import tempfile
 import urllib
+from functools import lru_cache
+from boto3.s3.transfer import TransferConfig
+from botocore.client import Config
+from botocore.exceptions import ClientError
 from urllib.parse import urlparse, parse_qs, urlunparse, urlencode
 import logging
 import io
@@ -13,12 +17,57 @@ logger = logging.getLogger(__name__)
 MAX_FILE_SPLITS = 9999
 DEFAULT_FILE_SPLIT_SIZE = 6291456
 DEFAULT_MINIMUM_SPLIT_AT_SIZE = 20000000
+MAX_POOL_CONNECTIONS = 50
+MAX_RETRY_ATTEMPTS = 3
+CONNECT_TIMEOUT = 1
+READ_TIMEOUT = 10
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+MAX_UPLOAD_CONCURRENCY = 4
+
+# - Files at or above the threshold (e.g. large stitched screenshots) are uploaded as parallel multipart chunks
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE,
+                                 max_concurrency=MAX_UPLOAD_CONCURRENCY, use_threads=True)
+
+# - The ClientError codes S3 responds with when a key does not exist
+NOT_FOUND_ERROR_CODES = ("404", "NoSuchKey", "NotFound")
+
+# - The number of distinct file extensions whose guessed Content-Type is remembered
+MIME_TYPE_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=MIME_TYPE_CACHE_SIZE)
+def _guess_extension_mime_type(extension):
+    """
+    Guesses the Content-Type for a file extension. Results are cached since the answer never changes for an extension
+    :param
+        - extension:    string - The lowercased extension, including the leading dot (e.g. ".png" or ".tar.gz")
+    :return
+        - mime_type:    string - The guessed Content-Type, or None if it could not be guessed
+    """
+    return mimetypes.guess_type(f"file{extension}")[0]
+
+
+def _guess_mime_type(filename):
+    """
+    Guesses the Content-Type of a file from its extension
+    :param
+        - filename:     string - The name of the file, including its extension
+    :return
+        - mime_type:    string - The guessed Content-Type, or None if it could not be guessed
+    """
+    root, extension = os.path.splitext(filename)
+    extension = extension.lower()
+    # - Compression extensions like ".gz" describe an encoding, so the type comes from the extension before it
+    if extension in mimetypes.encodings_map:
+        extension = os.path.splitext(root)[1].lower() + extension
+    return _guess_extension_mime_type(extension)
 
 
 class S3Client(object):
     """A client that helps user to send and get files from S3"""
+    # - The boto3 client is shared by every S3Client instance so its HTTPS connection pool is reused between calls
     s3_connection = None
-    bucket = None
 
     def __init__(self, bucket):
         """
@@ -27,24 +76,32 @@ class S3Client(object):
             - bucket:   string - The name of the bucket you will be working with
         """
         self.bucket_name = bucket
+        # - Object summaries gathered by prefetch_folder(), keyed on the full S3 key
+        self._listing_cache = {}
 
     def connect(self):
-        """Start the amazon connection using the system's boto.cfg file to retrieve the credentials"""
+        """
+        Lazily creates the boto3 S3 client shared by all S3Client instances. Credentials are resolved through boto3's
+        default chain (AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY environment variables, config files, instance roles)
+        """
         if self.s3_connection:
             return
 
         try:
-            self.s3_connection = boto3.client('s3', aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-                            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'])
+            # - Keep pooled connections alive between calls so small PUT/GET/HEAD requests skip the TCP + TLS
+            # handshake, and allow enough connections that concurrent uploads don't exhaust the pool
+            config = Config(tcp_keepalive=True,
+                            max_pool_connections=MAX_POOL_CONNECTIONS,
+                            connect_timeout=CONNECT_TIMEOUT,
+                            read_timeout=READ_TIMEOUT,
+                            retries={"max_attempts": MAX_RETRY_ATTEMPTS})
+            type(self).s3_connection = boto3.client("s3", config=config)
 
         except Exception as s3_connection_exception:
             # - Reset the variables on failure to allow a reconnect
-            self.s3_connection = None
-            self.bucket_name = None
+            type(self).s3_connection = None
             message = f"Exception while connecting to S3: {s3_connection_exception}"
-            raise message
-
-
+            raise S3ClientException(message)
 
     def store_file(self, s3_path, file_to_store, filename, return_url=False, mime_type=None):
         """
@@ -54,6 +111,7 @@ class S3Client(object):
             - file_to_store:    BytesIO or string - The fileIO or file local file path for the file to be sent
             - filename:         string - The name the file will have when on S3. Should include the file extension
             - return_url:       boolean - Whether to return the path to the file on S3
+            - mime_type:        string - The Content-Type to store the file with. Guessed from the filename if not set
         :return
             - file_url:         string - The path to the file on S3. This is returned only is return_url is set to true
         """
@@ -61,15 +119,17 @@ class S3Client(object):
 
         try:
             s3_file_path = self._generate_file_path(s3_path, filename)
-            if isinstance(file_to_store, io.BytesIO):
-                file_type = type(file_to_store)
-                if file_type in [str, bytes, io.BytesIO]:
-                    self.s3_connection.put_object(Body=file_to_store, Bucket=self.bucket_name, Key=s3_file_path)
-                else:
-                    self.s3_connection.put_object(Body=file_to_store, Bucket=self.bucket_name, Key=s3_file_path)
+            if not mime_type:
+                mime_type = _guess_mime_type(filename)
+            extra_args = {"ContentType": mime_type} if mime_type else None
+
+            if isinstance(file_to_store, str):
+                self.s3_connection.upload_file(file_to_store, self.bucket_name, s3_file_path, ExtraArgs=extra_args,
+                                               Config=TRANSFER_CONFIG)
             else:
-                self.s3_connection.upload_file(file_to_store, self.bucket_name, s3_file_path)
-            
+                self.s3_connection.upload_fileobj(file_to_store, self.bucket_name, s3_file_path,
+                                                  ExtraArgs=extra_args, Config=TRANSFER_CONFIG)
+
             if return_url:
                 file_url = self.s3_connection.generate_presigned_url('put_object', Params={'Bucket': self.bucket_name, 'Key': s3_file_path, 'ACL': 'public-read'}, ExpiresIn=360000)
                 # Additional check for s3 AccessToken
@@ -84,7 +144,7 @@ class S3Client(object):
 
         except Exception as store_file_exception:
             message = f"Exception while storing file on S3: {store_file_exception}"
-            raise message
+            raise S3ClientException(message)
 
     def get_file(self, s3_path, file_to_get):
         """
@@ -93,16 +153,23 @@ class S3Client(object):
             - s3_path:      string - The S3 path to the folder which contains the file
             - file_to_get:  string - The name of the file you are looking for in the folder
         :return
-            - retrieved_file    StringIO - an IO object containing the content of the file retrieved from S3
+            - retrieved_file    BytesIO - an IO object containing the content of the file retrieved from S3
         """
         self.connect()
 
         try:
             if self.verify_file(s3_path, file_to_get):
+                file_path = self._generate_file_path(s3_path, file_to_get)
                 retrieved_file = io.BytesIO()
-                s3_file = self.bucket.get_key(
-                    self._generate_file_path(s3_path, file_to_get))
-                s3_file.get_contents_to_file(retrieved_file)
+                try:
+                    self.s3_connection.download_fileobj(self.bucket_name, file_path, retrieved_file)
+                except ClientError as client_error:
+                    if client_error.response.get("Error", {}).get("Code") not in NOT_FOUND_ERROR_CODES:
+                        raise
+                    # - The file was deleted after a prefetch_folder() listing cached it
+                    self._listing_cache.pop(file_path, None)
+                    raise S3ClientException("File not found in S3")
+                retrieved_file.seek(0)
                 return retrieved_file
             else:
                 raise S3ClientException("File not found in S3")
@@ -114,22 +181,29 @@ class S3Client(object):
     def verify_file(self, s3_path, file_to_verify):
         """
         Verifies a file (e.g. configuration file) is on S3 and returns
-        "True" or "False".
+        "True" or "False". Files listed by prefetch_folder() or get_all_filenames_in_folder() are reported as present
+        without a HEAD request, even if they have been deleted from S3 since. Call prefetch_folder() again, or
+        clear_listing_cache(), to pick up changes made after the listing.
         :param
             - s3_path:          string - The S3 path to the folder which contains the file
             - file_to_verify:   string - The name of the file you are looking for in the folder
         :return
-            - boolean:     True if .get_key returns an instance of a Key object and False if .get_key returns None:
+            - boolean:     True if a HEAD request finds the file and False if S3 responds that it does not exist
         """
         self.connect()
         try:
             file_path = self._generate_file_path(s3_path, file_to_verify)
-            s3_file = self.bucket.get_key(file_path)
-            if s3_file:
+            # - Files seen by a previous prefetch_folder() listing don't need their own HEAD request
+            if file_path in self._listing_cache:
                 return True
-            else:
-                return False
+            self.s3_connection.head_object(Bucket=self.bucket_name, Key=file_path)
+            return True
 
+        except ClientError as client_error:
+            if client_error.response.get("Error", {}).get("Code") in NOT_FOUND_ERROR_CODES:
+                return False
+            message = f"Exception while verifying file on S3: {client_error}"
+            raise S3ClientException(message)
         except Exception as verify_file_exception:
             message = f"Exception while verifying file on S3: {verify_file_exception}"
             raise S3ClientException(message)
@@ -145,33 +219,54 @@ class S3Client(object):
         """
         return f"{(s3_path.strip('/'))}/{(file_to_store.strip('/'))}"
 
-    def get_all_filenames_in_folder(self, path_to_folder):
+    def prefetch_folder(self, prefix):
         """
-        Retrieves a list of the files/keys in a folder on S3
+        Lists every file under the given prefix with one paginated LIST request and caches the results so that
+        subsequent verify_file() calls for those files do not each need a HEAD request. Any files previously cached
+        under the prefix are replaced, so files deleted since the last listing are dropped from the cache
         :param
-            - path_to_folder:   string - The path to the folder on S3. This should start after the bucket name
+            - prefix:   string - The path to the folder on S3. This should start after the bucket name
         :return
-            - key_list: list - The list of keys in the folder
+            - key_list: list - The list of object summaries (dicts with "Key", "LastModified", "Size", etc.)
         """
         self.connect()
 
-        s3_folder_path = str(path_to_folder)
-        key_list = self.bucket.list(prefix=s3_folder_path)
+        key_list = []
+        paginator = self.s3_connection.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=str(prefix)):
+            key_list.extend(page.get("Contents", []))
+
+        for key in [key for key in self._listing_cache if key.startswith(str(prefix))]:
+            del self._listing_cache[key]
+        for object_summary in key_list:
+            self._listing_cache[object_summary["Key"]] = object_summary
         return key_list
 
+    def clear_listing_cache(self):
+        """
+        Forgets every file cached by prefetch_folder(), so that verify_file() goes back to a HEAD request per file
+        """
+        self._listing_cache.clear()
+
+    def get_all_filenames_in_folder(self, path_to_folder):
+        """
+        Retrieves a list of the files/keys in a folder on S3
+        :param
+            - path_to_folder:   string - The path to the folder on S3. This should start after the bucket name
+        :return
+            - key_list: list - The list of object summaries (dicts with "Key", "LastModified", "Size", etc.)
+        """
+        return self.prefetch_folder(path_to_folder)
+
     def get_most_recent_file_from_s3_key_list(self, key_list):
         """
         Sorts through the list of files in s3 key list object and returns the most recently modified file in the list
         :param
-            - key_list:    list - The list of files returned from a s3.bucket.list() operation
+            - key_list:    list - The list of object summaries returned from get_all_filenames_in_folder()
         :return
-            - key   boto.s3.Key - The most recently modified file in the key list
+            - key   dict - The most recently modified object summary in the key list, or None if the list is empty
         """
-        most_recent_key = None
-        for key in key_list:
-            if not most_recent_key or key.last_modified > most_recent_key.last_modified:
-                most_recent_key = key
-        return most_recent_key
+        return max(key_list, key=lambda key: key["LastModified"], default=None)
 
     def _split_file(self, from_file, file_chunk_size=DEFAULT_FILE_SPLIT_SIZE):
         """
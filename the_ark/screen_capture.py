@@ -1,9 +1,11 @@
-import base64
 import math
 import numpy
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from src.the_ark.selenium_helpers import SeleniumHelperExceptions, ElementNotVisibleError, ElementError
-from io import StringIO, BytesIO
+from src.the_ark.selenium_helpers import SeleniumHelperExceptions
+from io import BytesIO, RawIOBase
 import time
 import traceback
 
@@ -12,6 +14,8 @@ SCREENSHOT_FILE_EXTENSION = "png"
 DEFAULT_PIXEL_MATCH_OFFSET = 100
 FIREFOX_HEAD_HEIGHT = 75
 MAX_IMAGE_HEIGHT = 32768.0
+DEFAULT_PNG_COMPRESS_LEVEL = 1
+DEFAULT_UPLOAD_WORKERS = 4
 
 
 class Screenshot:
@@ -20,7 +24,8 @@ class Screenshot:
     """
     def __init__(self, selenium_helper, paginated=False, header_ids=None, footer_ids=None,
                  scroll_padding=DEFAULT_SCROLL_PADDING, pixel_match_offset=DEFAULT_PIXEL_MATCH_OFFSET,
-                 file_extenson=SCREENSHOT_FILE_EXTENSION, resize_delay=0, content_container_selector="html"):
+                 file_extenson=SCREENSHOT_FILE_EXTENSION, resize_delay=0, content_container_selector="html",
+                 compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
         """
         Initializes the Screenshot class. These variable will be used throughout to help determine how to capture pages
         for this website.
@@ -39,6 +44,8 @@ class Screenshot:
                                     to create an overlapping of content shown on both images to not cut any text in half
             - file_extenson:    string - If provided, this extension will be used while creating the image. This must
                                         be an extension that is usable with PIL
+            - compress_level:   int - The zlib compression level (0-9) used when saving PNG images. Lower levels are
+                                    much faster to encode at the cost of slightly larger files
         """
         # Set parameters as class variables
         self.sh = selenium_helper
@@ -49,6 +56,7 @@ class Screenshot:
         self.scroll_padding = scroll_padding
         self.pixel_match_offset = pixel_match_offset
         self.file_extenson = "png"
+        self.compress_level = compress_level
 
         self.headless = self.sh.desired_capabilities.get("headless", False)
         self.head_padding = FIREFOX_HEAD_HEIGHT if self.sh.desired_capabilities ["browserName"] == "firefox" else 0
@@ -64,7 +72,7 @@ class Screenshot:
         :param
             - viewport_only:  bool - Whether to capture just the viewport's visible area or not
         :return
-            - StringIO: A StingIO object containing the captured image(s)
+            - BytesIO: A BytesIO object containing the captured image(s)
         """
         try:
             if self.headless:
@@ -84,6 +92,86 @@ class Screenshot:
             message = f"Unhandled exception while taking the screenshot | {e}"
             raise ScreenshotException(message, stacktrace=traceback.format_exc())
 
+    def capture_page_to_s3(self, s3_client, s3_path, filename, viewport_only=False, return_url=False):
+        """
+        Captures a single screenshot of the page, like capture_page(), and stores it on S3. The image is encoded
+        straight into the upload rather than into an in-memory file first. Raises a ScreenshotException for paginated
+        Screenshot instances unless viewport_only is set, use capture_paginated_page_to_s3() to store those.
+        :param
+            - s3_client:        S3Client() - The S3 client the image will be stored with
+            - s3_path:          string - The S3 path to the folder in which the image will be stored
+            - filename:         string - The name the image will have on S3. Should include the file extension
+            - viewport_only:    bool - Whether to capture just the viewport's visible area or not
+            - return_url:       bool - Whether to return the S3 url of the image
+        :return
+            - file_url:     string - The path to the image on S3. Only returned if return_url is True
+        """
+        if self.paginated and not viewport_only:
+            raise ScreenshotException("capture_page_to_s3() stores a single image. Use capture_paginated_page_to_s3() "
+                                      "to store paginated screenshots", details={"s3_path": s3_path})
+
+        try:
+            if self.headless:
+                return s3_client.store_file(s3_path, self._capture_headless_page(viewport_only), filename,
+                                            return_url=return_url)
+            elif viewport_only:
+                image = self._get_image_data(viewport_only=True)
+            else:
+                image = self._get_full_page_image()
+            return self._stream_image_to_s3(image, s3_client, s3_path, filename, return_url=return_url)
+
+        except SeleniumHelperExceptions as selenium_error:
+            message = "A selenium issue arose while taking the screenshot"
+            error = SeleniumError(message, selenium_error)
+            raise error
+        except Exception as e:
+            message = f"Unhandled exception while taking the screenshot | {e}"
+            raise ScreenshotException(message, stacktrace=traceback.format_exc(), details={"s3_path": s3_path})
+
+    def capture_paginated_page_to_s3(self, s3_client, s3_path, filename_prefix="page", padding=None,
+                                     return_url=False, upload_workers=DEFAULT_UPLOAD_WORKERS):
+        """
+        Captures the page viewport by viewport, like a paginated capture_page(), and stores each image on S3. Every
+        upload runs on a background thread while the next viewport is being captured so the network time of the
+        uploads overlaps with the Selenium time of the captures.
+        :param
+            - s3_client:        S3Client() - The S3 client the images will be stored with
+            - s3_path:          string - The S3 path to the folder in which the images will be stored
+            - filename_prefix:  string - Each image is stored as "<filename_prefix>_<index>.<file extension>"
+            - padding:          int - Overwrites the default scroll padding for the class
+            - return_url:       bool - Whether to return the S3 urls of the images instead of their filenames
+            - upload_workers:   int - The number of uploads that can run at the same time
+        :return
+            - list: The filenames (or urls, if return_url is True) of the stored images, in page order
+        """
+        try:
+            # Create the shared S3 connection up front so the upload threads don't race to create it
+            s3_client.connect()
+            futures = []
+            with ThreadPoolExecutor(max_workers=upload_workers) as executor:
+                def upload_image(index, image_file):
+                    filename = f"{filename_prefix}_{index}.{self.file_extenson}"
+                    future = executor.submit(s3_client.store_file, s3_path, image_file, filename,
+                                             return_url=return_url)
+                    futures.append((filename, future))
+
+                if self.headless:
+                    self._capture_headless_paginated_page(padding, on_capture=upload_image)
+                else:
+                    self._capture_paginated_page(padding, on_capture=upload_image)
+
+            # Wait on every upload so that any storage error is raised here
+            results = [(filename, future.result()) for filename, future in futures]
+            return [url if return_url else filename for filename, url in results]
+
+        except SeleniumHelperExceptions as selenium_error:
+            message = "A selenium issue arose while taking the screenshot"
+            error = SeleniumError(message, selenium_error)
+            raise error
+        except Exception as e:
+            message = f"Unhandled exception while taking the screenshot | {e}"
+            raise ScreenshotException(message, stacktrace=traceback.format_exc(), details={"s3_path": s3_path})
+
     def capture_scrolling_element(self, css_selector, viewport_only=True, scroll_padding=None):
         """
         This method will scroll an element one height (with padding) and take a screenshot each scroll until the element
@@ -96,18 +184,22 @@ class Screenshot:
             - scroll_padding:   int    - Overwrites the default scroll padding for the class. This can be used when the
                                        element, or site, have greatly different scroll padding numbers
         :return
-            - StringIO:     list - A list containing multiple StringIO image objects
+            - BytesIO:      list - A list containing multiple BytesIO image objects
         """
         padding = scroll_padding if scroll_padding else self.scroll_padding
 
         try:
             image_list = []
+            # Chromium drivers can capture just the viewport through the DevTools Protocol, without a crop afterwards
+            use_devtools = viewport_only and not self.headless and hasattr(self.sh.driver, "execute_cdp_cmd")
             # Scroll the element to the top
             self.sh.scroll_an_element(css_selector, scroll_top=True)
 
             while True:
                 if self.headless:
                     image_list.append(self._capture_headless_page(viewport_only))
+                elif use_devtools:
+                    image_list.append(self._capture_devtools_viewport())
                 elif viewport_only:
                     image_list.append(self._capture_single_viewport())
                 else:
@@ -146,7 +238,7 @@ class Screenshot:
             - scroll_padding:   int    - Overwrites the default scroll padding for the class. This can be used when the
                                        element, or site, have greatly different scroll padding numbers
         :return
-            - StringIO:     list - A list containing multiple StringIO image objects
+            - BytesIO:      list - A list containing multiple BytesIO image objects
         """
         padding = scroll_padding if scroll_padding else self.scroll_padding
 
@@ -182,22 +274,43 @@ class Screenshot:
                                       stacktrace=traceback.format_exc(),
                                       details={"css_selector": css_selector})
 
-    def _capture_single_viewport(self):
+    def _capture_single_viewport(self, scroll_position=None, viewport_size=None):
         """
         Grabs an image of the page and then craps it to just the visible / viewport area
+        :param
+            - scroll_position:  int - The current scroll position of the window, if already known
+            - viewport_size:    tuple - The (width, height) of the viewport, if already known
         :return
-            - StringIO: A StingIO object containing the captured image
+            - BytesIO: A BytesIO object containing the captured image
         """
-        cropped_image = self._get_image_data(viewport_only=True)
+        cropped_image = self._get_image_data(viewport_only=True, scroll_position=scroll_position,
+                                             viewport_size=viewport_size)
         return self._create_image_file(cropped_image)
 
+    def _capture_devtools_viewport(self):
+        """
+        Grabs an image of just the visible / viewport area through the Chrome DevTools Protocol. The browser only
+        returns the viewport as a PNG, so unlike _capture_single_viewport() the image is neither cropped nor re-encoded
+        :return
+            - BytesIO: A BytesIO object containing the captured image
+        """
+        return BytesIO(self.sh.get_screenshot_png_cdp())
+
     def _capture_full_page(self):
+        """
+        Captures an image of the whole page and saves it into a file object. See _get_full_page_image()
+        :return
+            - BytesIO: A BytesIO object containing the captured image
+        """
+        return self._create_image_file(self._get_full_page_image())
+
+    def _get_full_page_image(self):
         """
         Captures an image of the whole page. If there are sitcky elements, as specified by the footers and headers
         class variables the code will, the code will capture them only where appropriate ie. headers on top, footers on
         bottom. Otherwise the whole screen is sent back as it is currently set up.
         :return
-            - StringIO: A StingIO object containing the captured image
+            - image:    Image() - The image canvas of the captured page
         """
         if self.headers and self.footers:
             # Capture viewport size window of the headers
@@ -220,17 +333,17 @@ class Screenshot:
         elif self.headers:
             # Scroll to the top so that the headers are not covering content
             self.sh.scroll_window_to_position(0)
-            time.sleep(0.5)
+            self.sh.wait_for_scroll_settled()
             image_data = self._get_image_data()
         elif self.footers:
             # Scroll to the bottom so that the footer items are not covering content
             self.sh.scroll_window_to_position(40000)
-            time.sleep(0.5)
+            self.sh.wait_for_scroll_settled()
             image_data = self._get_image_data()
         else:
             image_data = self._get_image_data()
 
-        return self._create_image_file(image_data)
+        return image_data
 
     def _hide_elements(self, css_selectors):
         """
@@ -238,14 +351,7 @@ class Screenshot:
         :param
             - css_selectors:    list - A list of the elements you would like to hide
         """
-        for selector in css_selectors:
-            try:
-                self.sh.hide_element(selector)
-            # Continue to the next item is this one did not exist or was already not visible
-            except ElementNotVisibleError:
-                pass
-            except ElementError:
-                pass
+        self._set_elements_display(css_selectors, "none")
 
     def _show_elements(self, css_selectors):
         """
@@ -253,13 +359,23 @@ class Screenshot:
         :param
             - css_selectors:    list - A list of the elements you would like to make visible
         """
-        # Show footer items again
-        for selector in css_selectors:
-            try:
-                self.sh.show_element(selector)
-            # Continue to the next item is this one did not exist
-            except ElementError:
-                pass
+        self._set_elements_display(css_selectors, "block")
+
+    def _set_elements_display(self, css_selectors, display):
+        """
+        Sets the display style of the first element matching each selector in a single script call, rather than one
+        Selenium round trip per element. Selectors that do not match anything on the page, or that are not valid CSS,
+        are skipped.
+        :param
+            - css_selectors:    list - A list of the elements whose display style you would like to set
+            - display:          string - The CSS display value to set, e.g. "none" or "block"
+        """
+        self.sh.execute_script("var display = arguments[1];"
+                               "arguments[0].forEach(function(selector) {"
+                               "    var element = null;"
+                               "    try { element = document.querySelector(selector); } catch (e) {}"
+                               "    if (element) { element.style.display = display; }"
+                               "});", list(css_selectors), display)
 
     def _capture_headless_page(self, viewport_only):
         if self.paginated and not viewport_only:
@@ -286,25 +402,18 @@ class Screenshot:
 
                 # Loop through, starting at one for multiplication purposes
                 for i in range(1, number_of_loops + 1):
-                    image_data = self.sh.get_screenshot_base64()
-                    decoded_data = base64.b64decode(image_data)
-                    image = Image.open(BytesIO(decoded_data))
+                    image = Image.open(BytesIO(self.sh.get_screenshot_png()))
                     images_list.append(image)
                     self.sh.scroll_window_to_position(self.max_height * i)
 
                 # Combine all of the images into one capture
                 image = self._combine_vertical_images(images_list, content_height)
             else:
-                # Gather image byte data
-                image_data = self.sh.get_screenshot_base64()
-                # Create an image canvas and write the byte data to it
-                decoded_data = base64.b64decode(image_data)
-                image = Image.open(BytesIO(decoded_data))
+                # Gather the PNG bytes and create an image canvas from them
+                image = Image.open(BytesIO(self.sh.get_screenshot_png()))
         else:
-            # Gather image byte data
-            image_data = self.sh.get_screenshot_base64()
-            # Create an image canvas and write the byte data to it
-            image = Image.open(BytesIO(base64.b64decode(image_data)))
+            # Gather the PNG bytes and create an image canvas from them
+            image = Image.open(BytesIO(self.sh.get_screenshot_png()))
         # - Return the browser to its previous size and scroll position
         if not viewport_only:
             self.sh.resize_browser(width, height)
@@ -340,10 +449,14 @@ class Screenshot:
 
         return resulting_image
 
-    def _capture_paginated_page(self, padding=None):
+    def _capture_paginated_page(self, padding=None, on_capture=None):
         """
         Captures the page viewport by viewport, leaving an overlap of pixels the height of the self.padding variable
         between each image
+        :param
+            - padding:      int - Overwrites the default scroll padding for the class
+            - on_capture:   callable - If provided, called with the index and image file of each viewport as soon as
+                                it is captured, before scrolling on to the next one
         """
         image_list = []
         scroll_padding = padding if padding else self.scroll_padding
@@ -352,15 +465,21 @@ class Screenshot:
         self.sh.scroll_window_to_position(0)
 
         current_scroll_position = 0
-        viewport_height = self.sh.driver.execute_script("return document.documentElement.clientHeight")
+        # The viewport doesn't change size while scrolling, so look it up once rather than on every capture
+        viewport_size = self.sh.get_viewport_size()
+        viewport_height = viewport_size[1]
 
         while True:
-            # Capture the image
-            image_list.append(self._capture_single_viewport())
+            # Capture the image. The scroll position is already known from the last scroll so it is passed along
+            image_file = self._capture_single_viewport(scroll_position=current_scroll_position,
+                                                       viewport_size=viewport_size)
+            image_list.append(image_file)
+            if on_capture:
+                on_capture(len(image_list) - 1, image_file)
 
             # Scroll for the next one!
             self.sh.scroll_window_to_position(current_scroll_position + viewport_height - scroll_padding)
-            time.sleep(0.25)
+            self.sh.wait_for_scroll_settled(max_wait=0.25)
             new_scroll_position = self.sh.get_window_current_scroll_position()
 
             # Break if the scroll position did not change (because it was at the bottom)
@@ -371,10 +490,14 @@ class Screenshot:
 
         return image_list
 
-    def _capture_headless_paginated_page(self, padding=None):
+    def _capture_headless_paginated_page(self, padding=None, on_capture=None):
         """
         Captures the page viewport by viewport, leaving an overlap of pixels the height of the self.padding variable
         between each image
+        :param
+            - padding:      int - Overwrites the default scroll padding for the class
+            - on_capture:   callable - If provided, called with the index and image file of each viewport as soon as
+                                it is captured, before scrolling on to the next one
         """
         image_list = []
         scroll_padding = padding if padding else self.scroll_padding
@@ -387,15 +510,15 @@ class Screenshot:
 
         while True:
             # Capture the image
-            image_data = self.sh.get_screenshot_base64()
-            decoded_data = base64.b64decode(image_data)
-            image = Image.open(BytesIO(decoded_data))
+            image = Image.open(BytesIO(self.sh.get_screenshot_png()))
             image_file = self._create_image_file(image)
             image_list.append(image_file)
+            if on_capture:
+                on_capture(len(image_list) - 1, image_file)
 
             # Scroll for the next one!
             self.sh.scroll_window_to_position(current_scroll_position + viewport_height - scroll_padding)
-            time.sleep(0.25)
+            self.sh.wait_for_scroll_settled(max_wait=0.25)
             new_scroll_position = self.sh.get_window_current_scroll_position()
 
             # Break if the scroll position did not change (because it was at the bottom)
@@ -406,32 +529,30 @@ class Screenshot:
 
         return image_list
 
-    def _get_image_data(self, viewport_only=False):
+    def _get_image_data(self, viewport_only=False, scroll_position=None, viewport_size=None):
         """
         Creates an Image() canvas of the page. The image is cropped to be only the viewport area if specified.
         :param
             - viewport_only:    bool - Captures only the visible /viewport area if true
+            - scroll_position:  int - The current scroll position of the window. Looked up through Selenium if None
+            - viewport_size:    tuple - The (width, height) of the viewport. Looked up through Selenium if None
 
         :return
             - image:    Image() - The image canvas of the captured data
         """
         # - Capture the image
-        # Gather image byte data
-        image_data = self.sh.get_screenshot_base64()
-    
-        # Create an image canvas and write the byte data to it
-        # image = Image.open(StringIO(image_data.decode('base64')))
-        decoded_data = base64.b64decode(image_data)
-        image = Image.open(BytesIO(decoded_data))
-
-        # image = Image.open(StringIO(base64.b64encode(base64.b64decode(image_data))))
-        # image = Image.open(BytesIO(image_data))
+        # Gather the PNG bytes and create an image canvas from them
+        image = Image.open(BytesIO(self.sh.get_screenshot_png()))
 
         # - Crop the image to just the visible area
         # Top of the viewport
-        current_scroll_position = self.sh.get_window_current_scroll_position()
+        if scroll_position is None:
+            scroll_position = self.sh.get_window_current_scroll_position()
+        current_scroll_position = scroll_position
         # Viewport Dimensions
-        viewport_width, viewport_height = self.sh.get_viewport_size()
+        if viewport_size is None:
+            viewport_size = self.sh.get_viewport_size()
+        viewport_width, viewport_height = viewport_size
 
         # Image size of data returned by Selenium
         image_height, image_width = image.size
@@ -464,10 +585,6 @@ class Screenshot:
             - stitched_image:   Image() - The resulting image of the crop and stitching of the header and footer images
         """
         try:
-            # Create Pixel Row arrays from each image
-            header_array = numpy.asarray(header_image)
-            footer_array = numpy.asarray(footer_image)
-
             # - Find a place in both images that match then crop and stitch them at that location
             crop_row = 0
             header_image_height = header_image.height
@@ -476,27 +593,15 @@ class Screenshot:
                 self.pixel_match_offset = header_image_height
 
             # - Find the pixel row in the footer image that matches the bottom row in the header image
-            # Grab the last 100 rows of header_image
-            header_last_hundred_rows = header_array[header_image_height - self.pixel_match_offset: header_image_height]
-
-            # Iterates throughout the check, will match the height of the row being checked in the image.
-            for i, footer_row in enumerate(footer_array):
-                # Jump out if the crop row has been set
-                if crop_row != 0:
-                    break
-
-                # Check if the current row being inspected matches the header row 100 pixels above the bottom
-                if numpy.array_equal(footer_row, header_last_hundred_rows[0]):
-                    # It is a match!
-                    for y, row in enumerate(header_last_hundred_rows):
-                        # Check that the 100 footer rows above the matching row also match the bottom 100 of
-                        # the header image we grabbed at the start of this check
-                        if numpy.array_equal(footer_array[i + y], header_last_hundred_rows[y]):
-                            # Check whether we've found 100 matching rows or not
-                            if y == self.pixel_match_offset - 1:
-                                # Yes! All 100 matched. Set the crop row to this row
-                                crop_row = i + self.pixel_match_offset
-                                break
+            # Grab the last 100 rows of header_image. Cropping before converting means only those rows are copied into
+            # the array rather than the whole header image
+            header_last_hundred_rows = numpy.asarray(header_image.crop((0,
+                                                                        header_image_height - self.pixel_match_offset,
+                                                                        header_image.width,
+                                                                        header_image_height)))
+            # Every footer row has to be scanned, so the footer is converted in full. All row checks use views into it
+            footer_array = numpy.asarray(footer_image)
+            crop_row = _find_crop_row(footer_array, header_last_hundred_rows)
 
             # If no rows matched, crop at height of header image
             if crop_row == 0:
@@ -531,22 +636,161 @@ class Screenshot:
 
     def _create_image_file(self, image):
         """
-        This method takes an Image() variable and saves it into a StringIO "file".
+        This method takes an Image() variable and saves it into a BytesIO "file".
         :param
-            - image_data:   Image() - The image to be saved into the StringIO object
+            - image_data:   Image() - The image to be saved into the BytesIO object
 
         :return
-            - image_file:   StingIO() - The stringIO object containing the saved image
+            - image_file:   BytesIO() - The BytesIO object containing the saved image
         """
         # Instantiate the file object
-        # image_file = StringIO()
-        image_file = BytesIO() # JB
+        image_file = BytesIO()
         # Save the image canvas to the file as the given file type
-        image.save(image_file, self.file_extenson.upper())
+        self._save_image(image, image_file)
         # Set the file marker back to the beginning
         image_file.seek(0)
         return image_file
 
+    def _save_image(self, image, image_file):
+        """
+        Saves an Image() variable into the given file object as the class's file type
+        :param
+            - image:        Image() - The image to be saved
+            - image_file:   file - The writable file object the image is saved into
+        """
+        if self.file_extenson.upper() == "PNG":
+            image.save(image_file, "PNG", compress_level=self.compress_level, optimize=False)
+        else:
+            image.save(image_file, self.file_extenson.upper())
+
+    def _stream_image_to_s3(self, image, s3_client, s3_path, filename, return_url=False):
+        """
+        Stores an image on S3 without first saving the whole encoded file in memory. The image is encoded on a
+        background thread into one end of a pipe while S3 reads the upload body from the other end.
+        :param
+            - image:        Image() - The image to be stored
+            - s3_client:    S3Client() - The S3 client the image will be stored with
+            - s3_path:      string - The S3 path to the folder in which the image will be stored
+            - filename:     string - The name the image will have on S3
+            - return_url:   bool - Whether to return the S3 url of the image
+        :return
+            - file_url:     string - The path to the image on S3. Only returned if return_url is True
+        """
+        read_fd, write_fd = os.pipe()
+        encode_errors = []
+
+        def encode_image():
+            try:
+                with open(write_fd, "wb") as write_end:
+                    self._save_image(image, write_end)
+            except Exception as encode_error:
+                encode_errors.append(encode_error)
+
+        encoder = threading.Thread(target=encode_image)
+        read_end = _EncodedImageReader(read_fd, encoder, encode_errors)
+        encoder.start()
+        try:
+            file_url = s3_client.store_file(s3_path, read_end, filename, return_url=return_url)
+        finally:
+            # Closing the read end unblocks the encoder if the upload stopped reading early
+            read_end.close()
+            encoder.join()
+
+        if encode_errors:
+            raise encode_errors[0]
+        return file_url
+
+
+class _EncodedImageReader(RawIOBase):
+    """
+    The reading end of the pipe an image is being encoded into by another thread. When the pipe runs dry the encoder's
+    error, if it had one, is raised instead of reporting the end of the file. That way an upload of a partly encoded
+    image fails rather than storing a truncated file.
+    """
+    def __init__(self, read_fd, encoder, encode_errors):
+        """
+        :param
+            - read_fd:          int - The file descriptor of the pipe's reading end
+            - encoder:          Thread() - The thread writing the encoded image into the pipe
+            - encode_errors:    list - Where the encoder thread records the exception it failed with, if any
+        """
+        super(_EncodedImageReader, self).__init__()
+        self._pipe = open(read_fd, "rb", buffering=0)
+        self._encoder = encoder
+        self._encode_errors = encode_errors
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self._pipe.readinto(buffer)
+        if not size:
+            # The encoder closes its end of the pipe on the way out, so it is already finishing here
+            self._encoder.join()
+            if self._encode_errors:
+                raise self._encode_errors[0]
+        return size
+
+    def close(self):
+        self._pipe.close()
+        super(_EncodedImageReader, self).close()
+
+
+def _pack_pixel_rows(pixel_array):
+    """
+    Flattens an image array into one row of values per pixel row. RGBA screenshots are packed as one uint32 per pixel
+    so that comparisons handle four channels per element rather than one.
+    :param
+        - pixel_array:  numpy.ndarray - The image array, e.g. from numpy.asarray(image)
+    :return
+        - pixel_rows:   numpy.ndarray - A contiguous (height, width) uint32 array for RGBA images, otherwise a
+                            (height, values per row) array of the original type
+    """
+    pixel_array = numpy.ascontiguousarray(pixel_array)
+    pixel_rows = pixel_array.reshape(len(pixel_array), -1)
+    if pixel_array.dtype == numpy.uint8 and pixel_array.ndim == 3 and pixel_array.shape[2] == 4:
+        pixel_rows = pixel_rows.view(numpy.uint32)
+    return pixel_rows
+
+
+def _find_crop_row(footer_array, header_rows):
+    """
+    Finds the first place in the footer image where all of the given header rows appear, in order.
+    :param
+        - footer_array: numpy.ndarray - The pixel rows of the footer image
+        - header_rows:  numpy.ndarray - The bottom rows of the header image that need to be found in the footer image
+    :return
+        - crop_row: int - The footer row directly below the matching block, or 0 if no match was found
+    """
+    offset = len(header_rows)
+    last_start_row = len(footer_array) - offset
+    # Rows of different widths or modes (e.g. RGB vs RGBA) can never match
+    if offset == 0 or last_start_row < 0 or footer_array.shape[1:] != header_rows.shape[1:] \
+            or footer_array.dtype != header_rows.dtype:
+        return 0
+
+    footer_rows = _pack_pixel_rows(footer_array)
+    header_rows = _pack_pixel_rows(header_rows)
+
+    # A match at the very top of the footer is always the first match, so it can be returned without scanning
+    if numpy.array_equal(footer_rows[:offset], header_rows):
+        return offset
+
+    # View each pixel row as a single fixed-width scalar so that footer rows can be compared against a header row in
+    # one vectorized pass, without building a per-pixel boolean array. A block can only start where both its first
+    # and its last row match, which rules out nearly every start row of a plain background in two passes
+    row_dtype = numpy.dtype((numpy.void, footer_rows[0].nbytes))
+    footer_scalars = footer_rows.view(row_dtype).ravel()
+    header_scalars = header_rows.view(row_dtype).ravel()
+    candidate_rows = numpy.flatnonzero((footer_scalars[:last_start_row + 1] == header_scalars[0]) &
+                                       (footer_scalars[offset - 1:] == header_scalars[-1]))
+
+    # Only the remaining candidates need the full block compare
+    for i in candidate_rows:
+        if numpy.array_equal(footer_rows[i:i + offset], header_rows):
+            return int(i) + offset
+    return 0
+
 
 class ScreenshotException(Exception):
     def __init__(self, msg, stacktrace=None, details=None):
@@ -1,3 +1,4 @@
+import base64
 import logging
 import requests
 import traceback
@@ -268,8 +269,40 @@ class SeleniumHelpers:
             message = f"Unable to get screenshot as base64. The browser might have been closed.\n{base64_error}"
             raise DriverAttributeError(msg=message, stacktrace=traceback.format_exc())
 
+    def get_screenshot_png(self):
+        """
+        Get image data of the current page as raw PNG bytes. The driver still decodes the base64 screenshot, this
+        just saves callers from decoding it themselves.
+        :return
+            -   png_image:  bytes - PNG image data of the current page.
+        """
+        try:
+            png_image = self.driver.get_screenshot_as_png()
+            return png_image
+        except Exception as png_error:
+            message = f"Unable to get screenshot as png. The browser might have been closed.\n{png_error}"
+            raise DriverAttributeError(msg=message, stacktrace=traceback.format_exc())
 
-
+    def get_screenshot_png_cdp(self, capture_beyond_viewport=False):
+        """
+        Get PNG image data of the current viewport through the Chrome DevTools Protocol. This is only available on
+        Chromium based drivers. The browser returns just the visible area, so callers don't need the scroll position and
+        viewport size lookups, or the PIL crop and re-encode, that cutting the viewport out of a WebDriver screenshot
+        takes. The image data still comes back base64 encoded and is decoded here.
+        :param
+            -   capture_beyond_viewport:    boolean - Whether to capture the whole page instead of only the viewport.
+        :return
+            -   png_image:  bytes - PNG image data of the current viewport.
+        """
+        try:
+            screenshot_options = {"format": "png", "captureBeyondViewport": capture_beyond_viewport}
+            screenshot = self.driver.execute_cdp_cmd("Page.captureScreenshot", screenshot_options)
+            png_image = base64.b64decode(screenshot["data"])
+            return png_image
+        except Exception as cdp_error:
+            message = "Unable to get screenshot through the DevTools Protocol. " \
+                      f"The browser might not support it.\n{cdp_error}"
+            raise DriverAttributeError(msg=message, stacktrace=traceback.format_exc())
 
     def save_screenshot_as_file(self, file_path, file_name):
         """
@@ -670,6 +703,24 @@ class SeleniumHelpers:
             message = f"Unable to scroll to position ({x_position!r}, {y_position!r}).\n{scroll_window_to_position_error}"
             raise DriverAttributeError(msg=message, stacktrace=traceback.format_exc())
 
+    def wait_for_scroll_settled(self, max_wait=0.5):
+        """
+        This will wait until the browser has painted the current scroll position, rather than sleeping for a fixed
+        amount of time. It waits for two animation frames (the frame the scroll was applied in, then the next paint),
+        falling back to max_wait in browsers that throttle animation frames, e.g. for background windows.
+        :param
+            -   max_wait:   float - The most time, in seconds, to wait for the animation frames.
+        """
+        try:
+            self.driver.execute_async_script("var done = arguments[arguments.length - 1];"
+                                             "var finished = false;"
+                                             "function finish() { if (!finished) { finished = true; done(); } }"
+                                             "requestAnimationFrame(function() { requestAnimationFrame(finish); });"
+                                             "setTimeout(finish, arguments[0]);", int(max_wait * 1000))
+        except Exception as wait_for_scroll_settled_error:
+            message = f"Unable to wait for the scroll position to settle.\n{wait_for_scroll_settled_error}"
+            raise DriverAttributeError(msg=message, stacktrace=traceback.format_exc())
+
     def get_window_current_scroll_position(self, get_both_positions=False, get_only_x_position=False):
         """
         This will get the current scroll position that the window is at. You can get both the X scroll position and Y